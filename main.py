@@ -1,9 +1,27 @@
 from __future__ import annotations
+import json
+import re
+import sys
 import uuid
 import datetime
 import time
-from typing import Optional, Callable, Any, Dict, List
-from pydantic import BaseModel
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from typing import Optional, Callable, Dict, List
+
+try:
+    import re2  # optional: google-re2, linear-time matching with no backtracking
+except ImportError:
+    re2 = None
+
+try:
+    import ahocorasick  # optional: pyahocorasick keyword automaton
+except ImportError:
+    ahocorasick = None
+
+# Set to True for demos to re-enable the artificial tool/restart delays
+SIMULATE_LATENCY = False
 
 # -----------------------------
 # Simple SDK-like decorators / stubs
@@ -24,41 +42,109 @@ def function_tool(func=None, *, name: Optional[str] = None):
 # -----------------------------
 # Context model
 # -----------------------------
-class UserContext(BaseModel):
+class _EmailLowerCache:
+    # kept outside the dataclass fields so asdict() (show_context) doesn't include it
+    __slots__ = ("_email_lower_src", "_email_lower")
+
+@dataclass(slots=True)
+class UserContext(_EmailLowerCache):
     name: Optional[str] = None
     email: Optional[str] = None
     is_premium_user: bool = False
     issue_type: Optional[str] = None  # e.g., 'billing', 'technical', 'general'
     last_ticket_id: Optional[str] = None
 
+    def __post_init__(self):
+        self._email_lower_src = self._email_lower = None
+
+    # cached_property needs an instance __dict__, so cache into slots instead; the source
+    # email is remembered so any reassignment of `email` triggers a recompute
+    @property
+    def email_lower(self) -> Optional[str]:
+        email = self.email
+        if email != self._email_lower_src:
+            self._email_lower_src = email
+            self._email_lower = email.lower() if email else None
+        return self._email_lower
+
 # -----------------------------
 # Simple in-memory tickets DB
 # -----------------------------
-TICKETS: List[Dict[str, Any]] = []
-
-def create_ticket_record(title: str, description: str, user: UserContext, category: str) -> Dict[str, Any]:
-    ticket = {
-        "id": str(uuid.uuid4()),
-        "title": title,
-        "description": description,
-        "user": {"name": user.name, "email": user.email},
-        "category": category,
-        "status": "open",
-        "created_at": datetime.datetime.utcnow().isoformat() + "Z",
-    }
-    TICKETS.append(ticket)
-    user.last_ticket_id = ticket["id"]
+@dataclass(slots=True)
+class Ticket:
+    id: str
+    title: str
+    description: str
+    user_name: Optional[str]
+    user_email: Optional[str]
+    category: str
+    status: str
+    created_at: str
+
+TICKETS: "OrderedDict[str, Ticket]" = OrderedDict()  # keyed by ticket id, oldest first
+MAX_TICKETS = 10_000  # oldest tickets are evicted past this size
+
+def create_ticket_record(title: str, description: str, user: UserContext, category: str) -> Ticket:
+    ticket = Ticket(
+        id=uuid.uuid4().hex,
+        title=title,
+        description=description,
+        user_name=user.name,
+        user_email=user.email,
+        category=category,
+        status="open",
+        created_at=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    )
+    TICKETS[ticket.id] = ticket
+    if len(TICKETS) > MAX_TICKETS:
+        TICKETS.popitem(last=False)
+    user.last_ticket_id = ticket.id
     return ticket
 
 # -----------------------------
 # Utility: Intent analysis (very simple)
 # -----------------------------
 
+_BILLING_WORDS = ("refund", "charge", "billing", "invoice", "payment")
+_TECH_WORDS = ("error", "bug", "not working", "crash", "restart", "slow", "timeout")
+
+def _compile_alternation(words):
+    # case-insensitive alternation of literal words; inline (?i) since re2 has no IGNORECASE flag
+    engine = re2 or re
+    return engine.compile("(?i)" + "|".join(map(engine.escape, words)))
+
+def _build_intent_automaton():
+    # one automaton over every keyword, each mapped to its category label
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for w in _BILLING_WORDS:
+        automaton.add_word(w, "billing")
+    for w in _TECH_WORDS:
+        automaton.add_word(w, "technical")
+    automaton.make_automaton()
+    return automaton
+
+_INTENT_AUTOMATON = _build_intent_automaton()
+
+# Compiled once at import; each category is matched in a single case-insensitive scan
+# (used when pyahocorasick isn't installed)
+_BILLING_RE = _compile_alternation(_BILLING_WORDS)
+_TECH_RE = _compile_alternation(_TECH_WORDS)
+
+@lru_cache(maxsize=1024)
 def analyze_intent(message: str) -> str:
-    m = message.lower()
-    if any(w in m for w in ["refund", "charge", "billing", "invoice", "payment"]):
+    if _INTENT_AUTOMATON is not None:
+        # billing wins over technical anywhere in the message, so only billing returns early
+        technical = False
+        for _, category in _INTENT_AUTOMATON.iter(message.lower()):
+            if category == "billing":
+                return "billing"
+            technical = True
+        return "technical" if technical else "general"
+    if _BILLING_RE.search(message):
         return "billing"
-    if any(w in m for w in ["error", "bug", "not working", "crash", "restart", "slow", "timeout"]):
+    if _TECH_RE.search(message):
         return "technical"
     return "general"
 
@@ -68,48 +154,54 @@ def analyze_intent(message: str) -> str:
 class OutputGuardrail:
     def __init__(self, banned_phrases: Optional[List[str]] = None):
         self.banned_phrases = banned_phrases or ["sorry", "apologize"]
+        # single case-insensitive alternation so enforce() is one pass over the text
+        self._pattern = _compile_alternation(self.banned_phrases) if self.banned_phrases else None
 
     def enforce(self, text: str) -> str:
-        lowered = text.lower()
-        for b in self.banned_phrases:
-            if b in lowered:
-                # remove banned phrase occurrences (simple approach)
-                text = text.replace(b, "[redacted]")
-        return text
+        # remove banned phrase occurrences regardless of case
+        return self._pattern.sub("[redacted]", text) if self._pattern else text
 
 # -----------------------------
 # Tools with dynamic is_enabled logic
 # -----------------------------
 class Tool:
-    def __init__(self, func: Callable, name: Optional[str] = None, is_enabled: Optional[Callable[[UserContext], bool]] = None):
+    __slots__ = ("func", "name", "is_enabled", "run")
+
+    def __init__(self, func: Callable, name: Optional[str] = None, is_enabled: Optional[Callable[[UserContext], bool]] = None, stream: bool = False):
         self.func = func
         self.name = name or func.__name__
         self.is_enabled = is_enabled or (lambda ctx: True)
+        # pick the run variant once so non-streaming tools never test the stream flag
+        self.run = self._run_stream if stream else self._run_plain
+
+    def _run_plain(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
 
-    def run(self, *args, stream: bool = False, **kwargs):
+    def _run_stream(self, *args, **kwargs):
         # stream_events simulation
-        if stream:
-            print(f"[stream] starting tool {self.name}...")
+        print(f"[stream] starting tool {self.name}...")
+        if SIMULATE_LATENCY:
             time.sleep(0.15)
         res = self.func(*args, **kwargs)
-        if stream:
-            print(f"[stream] finished tool {self.name} — result: {str(res)[:120]}")
+        print(f"[stream] finished tool {self.name} — result: {str(res)[:120]}")
         return res
 
 # Tools definitions
 @function_tool
 def create_ticket_tool(title: str, description: str, context: UserContext) -> dict:
+    # result["ticket"] is the stored Ticket object, not a dict
     ticket = create_ticket_record(title, description, context, category=context.issue_type or "general")
     return {"ok": True, "ticket": ticket}
 
 @function_tool
 def refund_tool(ticket_id: str, context: UserContext) -> dict:
     # refund only allowed if is_premium_user == True (enforced by is_enabled)
+    # on success result["ticket"] is the stored Ticket object, not a dict
     # Simulate refund
-    for t in TICKETS:
-        if t["id"] == ticket_id:
-            t["status"] = "refunded"
-            return {"ok": True, "ticket": t, "message": "Refund processed."}
+    t = TICKETS.get(ticket_id)
+    if t is not None:
+        t.status = "refunded"
+        return {"ok": True, "ticket": t, "message": "Refund processed."}
     return {"ok": False, "reason": "ticket_not_found"}
 
 @function_tool
@@ -118,48 +210,62 @@ def restart_service_tool(service_name: str, context: UserContext) -> dict:
     if context.issue_type != "technical":
         return {"ok": False, "reason": "wrong_issue_type"}
     # pretend restart
-    time.sleep(0.2)
+    if SIMULATE_LATENCY:
+        time.sleep(0.2)
     return {"ok": True, "message": f"Service '{service_name}' restarted successfully."}
 
 @function_tool
 def check_subscription_tool(email: str, context: UserContext) -> dict:
     # Simple simulation: premium if email contains 'pro' or context flag set
-    is_premium = context.is_premium_user or (email and "pro" in (email.lower() if email else ""))
+    is_premium = context.is_premium_user
+    if not is_premium and email:
+        is_premium = "pro" in (context.email_lower if email == context.email else email.lower())
     return {"email": email, "is_premium": bool(is_premium)}
 
 # Wrap tools with dynamic gating
 CREATE_TICKET = Tool(create_ticket_tool, name="create_ticket", is_enabled=lambda ctx: True)
 REFUND = Tool(refund_tool, name="refund", is_enabled=lambda ctx: ctx.is_premium_user is True)
-RESTART = Tool(restart_service_tool, name="restart_service", is_enabled=lambda ctx: ctx.issue_type == "technical")
+RESTART = Tool(restart_service_tool, name="restart_service", is_enabled=lambda ctx: ctx.issue_type == "technical", stream=True)
 CHECK_SUB = Tool(check_subscription_tool, name="check_subscription", is_enabled=lambda ctx: True)
 
 # -----------------------------
 # Agents
 # -----------------------------
 class BaseAgent:
+    __slots__ = ("name", "tools", "guardrail", "_enforce")
+
     def __init__(self, name: str, tools: Optional[List[Tool]] = None, guardrail: Optional[OutputGuardrail] = None):
         self.name = name
         self.tools = {t.name: t for t in (tools or [])}
         self.guardrail = guardrail
+        # bound once so respond() doesn't re-check the guardrail on every call
+        self._enforce = guardrail.enforce if guardrail else (lambda s: s)
 
     def can_use(self, tool_name: str, context: UserContext) -> bool:
         t = self.tools.get(tool_name)
         return bool(t and t.is_enabled(context))
 
-    def call_tool(self, tool_name: str, *args, stream: bool = False, **kwargs):
+    def call_tool(self, tool_name: str, *args, **kwargs):
         t = self.tools.get(tool_name)
         if not t:
             return {"ok": False, "reason": "tool_not_found"}
-        return t.run(*args, **kwargs, stream=stream)
+        return t.run(*args, **kwargs)
+
+    def _bind_tool(self, tool_name: str) -> Callable:
+        # the tool's run if this agent was given it, else call_tool's tool_not_found path
+        t = self.tools.get(tool_name)
+        if t:
+            return t.run
+        return lambda *args, **kwargs: self.call_tool(tool_name, *args, **kwargs)
 
     def respond(self, message: str, context: UserContext) -> str:
         # default echo -- specialized agents override
         out = f"{self.name} received: {message}"
-        if self.guardrail:
-            out = self.guardrail.enforce(out)
-        return out
+        return self._enforce(out)
 
 class TriageAgent(BaseAgent):
+    __slots__ = ("agents",)
+
     def __init__(self, name: str, agents: Dict[str, 'BaseAgent'], guardrail: Optional[OutputGuardrail] = None):
         super().__init__(name=name, tools=[], guardrail=guardrail)
         self.agents = agents
@@ -169,8 +275,11 @@ class TriageAgent(BaseAgent):
         intent = analyze_intent(message)
         context.issue_type = intent
         # simple scoring for premium detection
-        if not context.is_premium_user and context.email and "pro" in context.email.lower():
-            context.is_premium_user = True
+        # premium is sticky for the session, so only re-derive it while still False
+        if not context.is_premium_user:
+            email_lower = context.email_lower
+            if email_lower and "pro" in email_lower:
+                context.is_premium_user = True
 
         print(f"[ 🧭 Triage] intent detected: {intent} | is_premium: {context.is_premium_user}")
 
@@ -186,34 +295,43 @@ class TriageAgent(BaseAgent):
         return {"handoff_to": target, "context": context}
 
 class BillingAgent(BaseAgent):
+    __slots__ = ("_create_ticket", "_refund")
+
     def __init__(self, name: str, tools: List[Tool], guardrail: Optional[OutputGuardrail] = None):
         super().__init__(name=name, tools=tools, guardrail=guardrail)
+        self._create_ticket = self._bind_tool("create_ticket")
+        self._refund = self._bind_tool("refund")
 
     def respond(self, message: str, context: UserContext) -> str:
         # Simple logic: if user asks for refund, try refund tool (requires premium)
         m = message.lower()
         if "refund" in m or "charge" in m:
-            # Need a ticket first
-            if not context.last_ticket_id:
-                t_res = self.call_tool("create_ticket", title="Billing issue", description=message, context=context)
+            tid = None
+            # Need a ticket first (the last one may have been evicted from TICKETS)
+            if not context.last_ticket_id or context.last_ticket_id not in TICKETS:
+                t_res = self._create_ticket(title="Billing issue", description=message, context=context)
                 if t_res.get("ok"):
-                    tid = t_res["ticket"]["id"]
+                    tid = t_res["ticket"].id
                     print(f"[Billing] created ticket {tid}")
             # Attempt refund if tool enabled
             if self.can_use("refund", context):
-                res = self.call_tool("refund", context.last_ticket_id or tid, context=context)
+                res = self._refund(context.last_ticket_id or tid, context=context)
+                if res.get("ok"):
+                    # convert the Ticket only for display
+                    res = {**res, "ticket": asdict(res["ticket"])}
                 out = f" 💰 Refund result: {res}"
             else:
                 out = " ⚠️ Refunds are available only to premium users. Please upgrade or contact billing."
         else:
             out = "BillingAgent: I can help with refunds, charges, and invoices."
-        if self.guardrail:
-            out = self.guardrail.enforce(out)
-        return out
+        return self._enforce(out)
 
 class TechnicalAgent(BaseAgent):
+    __slots__ = ("_restart",)
+
     def __init__(self, name: str, tools: List[Tool], guardrail: Optional[OutputGuardrail] = None):
         super().__init__(name=name, tools=tools, guardrail=guardrail)
+        self._restart = self._bind_tool("restart_service")
 
     def respond(self, message: str, context: UserContext) -> str:
         m = message.lower()
@@ -222,30 +340,29 @@ class TechnicalAgent(BaseAgent):
                 context.issue_type = "technical"
             if self.can_use("restart_service", context):
                 svc = "main-service"
-                res = self.call_tool("restart_service", svc, context=context, stream=True)
+                res = self._restart(svc, context=context)
                 out = f" 🔧 TechnicalAgent: {res.get('message')}"
             else:
                 out = "Restart is not permitted for your issue type or the agent cannot perform it."
         else:
             out = "TechnicalAgent: I can attempt to restart services or create a ticket for engineering."
-        if self.guardrail:
-            out = self.guardrail.enforce(out)
-        return out
+        return self._enforce(out)
 
 class GeneralAgent(BaseAgent):
+    __slots__ = ("_create_ticket",)
+
     def __init__(self, name: str, tools: List[Tool], guardrail: Optional[OutputGuardrail] = None):
         super().__init__(name=name, tools=tools, guardrail=guardrail)
+        self._create_ticket = self._bind_tool("create_ticket")
 
     def respond(self, message: str, context: UserContext) -> str:
         # generic help: create ticket
-        t_res = self.call_tool("create_ticket", title="General inquiry", description=message, context=context)
+        t_res = self._create_ticket(title="General inquiry", description=message, context=context)
         if t_res.get("ok"):
-            out = f" 📩 GeneralAgent: Created ticket {t_res['ticket']['id']} for your request."
+            out = f" 📩 GeneralAgent: Created ticket {t_res['ticket'].id} for your request."
         else:
             out = " 📩 GeneralAgent: Could not create a ticket right now."
-        if self.guardrail:
-            out = self.guardrail.enforce(out)
-        return out
+        return self._enforce(out)
 
 # -----------------------------
 # Build agents and wire them
@@ -269,13 +386,16 @@ triage_agent = TriageAgent("TriageAgent", agents=agents_map, guardrail=guardrail
 # -----------------------------
 
 def print_help():
-   print("Commands:")
-print("  🪪 identify <Name> <email>   - set user identity and premium detection")
-print("  💬 ask <message>             - ask the system (triage + handoff)")
-print("  👤 show_context              - show current user context")
-print("  🎟️ tickets                   - list tickets (in-memory)")
-print("  ❓ help                      - show this help")
-print("  🚪 quit                      - exit")
+    print("Commands:")
+    print("  🪪 identify <Name> <email>   - set user identity and premium detection")
+    print("  💬 ask <message>             - ask the system (triage + handoff)")
+    print("  👤 show_context              - show current user context")
+    print("  🎟️ tickets                   - list tickets (in-memory)")
+    print("  ❓ help                      - show this help")
+    print("  🚪 quit                      - exit")
+
+# returned by a command handler to end the CLI loop
+_QUIT = object()
 
 
 
@@ -285,29 +405,48 @@ def cli_loop():
 
     print_help()
 
+    def show_context():
+        print(json.dumps(asdict(ctx), indent=2))
+
+    def show_tickets():
+        if not TICKETS:
+            print("No tickets yet")
+        else:
+            # one write for the whole listing instead of a print per ticket
+            sys.stdout.write("\n".join(f"-   🎫 {t.id} | {t.title} | {t.status} | {t.category}" for t in TICKETS.values()) + "\n")
+
+    def quit_():
+        print("Bye 👋")
+        return _QUIT
+
+    # exact-match commands; prefix commands (identify/ask) are handled below
+    handlers = {
+        "help": print_help,
+        "show_context": show_context,
+        "tickets": show_tickets,
+        "quit": quit_,
+        "exit": quit_,
+    }
+
+    # readline + explicit flush avoids input()'s per-call setup when input is piped
+    stdin, stdout = sys.stdin, sys.stdout
     while True:
+        stdout.write("\n> ")
+        stdout.flush()
         try:
-            raw = input("\n> ").strip()
-        except (EOFError, KeyboardInterrupt):
+            raw = stdin.readline()
+        except KeyboardInterrupt:
+            raw = ""
+        if not raw:  # EOF or Ctrl-C
             print("\nGoodbye")
             break
+        raw = raw.strip()
         if not raw:
             continue
-        if raw.lower() in ("quit", "exit"):
-            print("Bye 👋")
-            break
-        if raw.lower() == "help":
-            print_help()
-            continue
-        if raw.lower() == "show_context":
-            print(ctx.json(indent=2))
-            continue
-        if raw.lower() == "tickets":
-            if not TICKETS:
-                print("No tickets yet")
-            else:
-                for t in TICKETS:
-                    print(f"-   🎫 {t['id']} | {t['title']} | {t['status']} | {t['category']}")
+        handler = handlers.get(raw.lower())
+        if handler:
+            if handler() is _QUIT:
+                break
             continue
         if raw.startswith("identify "):
             parts = raw.split(maxsplit=2)
@@ -318,7 +457,7 @@ def cli_loop():
             ctx.name = name
             ctx.email = email
             # simple premium detection
-            if "pro" in email.lower():
+            if "pro" in ctx.email_lower:
                 ctx.is_premium_user = True
             print(f" ✅ Identified {ctx.name} <{ctx.email}> | premium: {ctx.is_premium_user}")
             continue